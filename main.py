@@ -1,9 +1,10 @@
 import streamlit as st
 import pandas as pd
 import psycopg2
-from datetime import datetime, timedelta
-import json
-import time
+import psycopg2.pool
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import io
 
 # Database connection parameters (using Streamlit secrets for secure connection)
 db_params = {
@@ -14,17 +15,34 @@ db_params = {
     'port': st.secrets["database"]["DB_PORT"]
 }
 
-# Function to establish connection and fetch data using psycopg2
-def fetch_data(query, params=None):
+# Shared connection pool so queries reuse established connections instead
+# of paying the TCP + auth handshake on every call. st.cache_resource keeps
+# a single pool across all Streamlit sessions.
+@st.cache_resource
+def get_pool():
+    return psycopg2.pool.ThreadedConnectionPool(minconn=1, maxconn=8, **db_params)
+
+# Function to fetch data using a pooled psycopg2 connection. COPY streams
+# the result as CSV and pandas' C parser builds the columns directly,
+# skipping psycopg2's per-row Python tuple conversion entirely. CSV loses
+# the database's column types, so callers pass explicit dtypes for any
+# column that must not be re-inferred from text (e.g. digit strings).
+def fetch_data(query, params=None, dtype=None):
+    pool = get_pool()
     connection = None
     cursor = None
     try:
-        connection = psycopg2.connect(**db_params)
+        connection = pool.getconn()
         cursor = connection.cursor()
-        cursor.execute(query, params)
-        records = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        df = pd.DataFrame(records, columns=column_names)
+        # COPY cannot take bind parameters, so interpolate them safely first
+        sql = cursor.mogrify(query, params).decode().rstrip().rstrip(';')
+        buffer = io.StringIO()
+        # Mark NULLs explicitly so only real SQL NULLs become NaN; without
+        # this, read_csv also treats values like "NA" or "None" as missing
+        # and conflates NULL with the empty string
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT CSV, HEADER, NULL '\\N')", buffer)
+        buffer.seek(0)
+        df = pd.read_csv(buffer, dtype=dtype, keep_default_na=False, na_values=['\\N'])
         return df
     except Exception as error:
         st.error(f"Error fetching records: {error}")
@@ -33,111 +51,127 @@ def fetch_data(query, params=None):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
-
-# Function to fetch client data for current_stage > 4
-def get_client_data_stage_greater_than_4():
-    now = datetime.now()
-    time_4_days_ago = now - timedelta(days=4)
-    
+            pool.putconn(connection)
+
+# Function to fetch recent client data for every stage except 4, in a single
+# round trip; main() splits the result into the > 4 and < 4 tables.
+# Cached so Streamlit reruns within the TTL skip the database round trip.
+# The cache key is the minute-floored bucket passed in from main(), so the
+# key changes at most once per minute instead of on every call.
+@st.cache_data(ttl=300, show_spinner=False)
+def get_client_data_recent(bucket, days=4):
+    cutoff = bucket - timedelta(days=days)
+
+    # DISTINCT ON keeps only the latest progression row per client, so the
+    # wire transfer and the DataFrame stay duplicate-free. Relies on the
+    # index on client_stage_progression (client_id, created_on).
+    # Project only what the table renders (plus current_stage for the
+    # split in main); created_on is only needed in the ORDER BY
     query = """
-    SELECT 
-        cp.client_id, 
-        cp.current_stage, 
-        cp.created_on, 
-        c.fullname AS client_fullname, 
-        c.fphone1, 
-        c.addresses,
+    SELECT DISTINCT ON (cp.client_id)
+        cp.client_id,
+        cp.current_stage,
+        c.fullname AS client_fullname,
+        c.fphone1,
+        c.addresses->0->>'city' AS city,
+        c.addresses->0->>'state' AS state,
+        c.addresses->0->>'street' AS street,
         e.fullname AS assigned_employee_fullname
     FROM client_stage_progression cp
     JOIN client c ON cp.client_id = c.id
     LEFT JOIN employee e ON c.assigned_employee = e.id
-    WHERE cp.current_stage > 4
-    AND cp.created_on > %s;
+    WHERE cp.current_stage <> 4
+    AND cp.created_on > %s
+    ORDER BY cp.client_id, cp.created_on DESC;
     """
-    
-    time_4_days_ago_str = time_4_days_ago.strftime('%Y-%m-%d %H:%M:%S')
-
-    return fetch_data(query, params=(time_4_days_ago_str,))
 
-# Function to fetch client data for current_stage < 4
-def get_client_data_stage_less_than_4():
-    now = datetime.now()
-    time_4_days_ago = now - timedelta(days=4)
-    
-    query = """
-    SELECT 
-        cp.client_id, 
-        cp.current_stage, 
-        cp.created_on, 
-        c.fullname AS client_fullname, 
-        c.fphone1, 
-        c.addresses,
-        e.fullname AS assigned_employee_fullname
-    FROM client_stage_progression cp
-    JOIN client c ON cp.client_id = c.id
-    LEFT JOIN employee e ON c.assigned_employee = e.id
-    WHERE cp.current_stage < 4
-    AND cp.created_on > %s;
-    """
-    
-    time_4_days_ago_str = time_4_days_ago.strftime('%Y-%m-%d %H:%M:%S')
-
-    return fetch_data(query, params=(time_4_days_ago_str,))
-
-# Process the client data to extract address information and handle unique client_ids
-def process_data(df):
-    def extract_address(addresses):
-        if isinstance(addresses, str):
-            try:
-                addresses = json.loads(addresses)
-            except json.JSONDecodeError:
-                return "", "", ""
-        
-        if isinstance(addresses, list) and len(addresses) > 0:
-            address = addresses[0]
-            city = address.get("city", "")
-            state = address.get("state", "")
-            street = address.get("street", "")
-            return city, state, street
-        return "", "", ""
-
-    df[['city', 'state', 'street']] = df['addresses'].apply(extract_address).apply(pd.Series)
-
-    # Remove duplicates based on client_id
-    df_unique_clients = df.drop_duplicates(subset=['client_id'])
-
-    return df_unique_clients
-
-# Function to fetch chat data from the database
-def fetch_chat_data(db_params, client_id):
+    # Keep the text columns as strings: a nullable phone column would
+    # otherwise be inferred as float64 ('5551234567.0') and digit phones
+    # would lose leading zeros. client_id/current_stage stay numeric for
+    # the > 4 split.
+    text_columns = {
+        'client_fullname': 'string',
+        'fphone1': 'string',
+        'city': 'string',
+        'state': 'string',
+        'street': 'string',
+        'assigned_employee_fullname': 'string',
+    }
+
+    # psycopg2 adapts datetime objects natively; no need to format a string
+    df = fetch_data(query, params=(cutoff,), dtype=text_columns)
+
+    # Low-cardinality string columns: categorical dtype stores each unique
+    # value once instead of one object per row. current_stage stays numeric
+    # because main() splits on it with an ordered comparison.
+    for col in ('assigned_employee_fullname', 'state'):
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    return df
+
+# Prepare the chat statements once per pooled connection so repeated chat
+# views skip Postgres parse + plan. PREPARE is transactional, so commit
+# immediately to survive the rollback putconn issues; the flag lives on the
+# connection object, which the pool hands back out across requests.
+def prepare_chat_statements(conn):
+    if getattr(conn, '_chat_statements_prepared', False):
+        return
+    cur = conn.cursor()
+    cur.execute("""
+        PREPARE chat_messages(int) AS
+        SELECT TO_CHAR(created, 'HH12:MM DD/MM/YYYY'),
+               CASE WHEN status = 'Received' THEN 'client' ELSE 'sales_rep' END,
+               message
+        FROM public.textmessage
+        WHERE client_id = $1
+        ORDER BY created ASC;
+    """)
+    cur.execute("""
+        PREPARE chat_client(int) AS
+        SELECT fullname, id, assigned_employee_name
+        FROM public.client
+        WHERE id = $1;
+    """)
+    conn.commit()
+    cur.close()
+    conn._chat_statements_prepared = True
+
+# Run one prepared statement on its own pooled connection; used by the
+# worker threads below so the two chat statements aren't serialized
+# through a single socket.
+def execute_chat_statement(statement, client_id):
+    pool = get_pool()
+    conn = None
     try:
-        conn = psycopg2.connect(**db_params)
+        conn = pool.getconn()
+        prepare_chat_statements(conn)
         cur = conn.cursor()
+        cur.execute(f"EXECUTE {statement}(%s)", (client_id,))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    finally:
+        if conn:
+            pool.putconn(conn)
 
-        chat_query = """
-            SELECT TO_CHAR(created, 'HH12:MM DD/MM/YYYY'), status, message
-            FROM public.textmessage
-            WHERE client_id = %s
-            ORDER BY created ASC;
-        """
-        cur.execute(chat_query, (client_id,))
-        chats = cur.fetchall()
-
-        client_query = """
-            SELECT fullname, id, assigned_employee_name
-            FROM public.client
-            WHERE id = %s;
-        """
-        cur.execute(client_query, (client_id,))
-        client_info = cur.fetchone()
-
-        chat_transcript = []
-        for timestamp, status, message in chats:
-            if status == "Received":
-                chat_transcript.append({"timestamp": timestamp, "role": "client", "message": message})
-            else:
-                chat_transcript.append({"timestamp": timestamp, "role": "sales_rep", "message": message})
+# Function to fetch chat data from the database, cached per client_id
+@st.cache_data(ttl=60)
+def fetch_chat_data(client_id):
+    try:
+        # Fire both statements concurrently; wall clock drops from the sum
+        # of the two query latencies to the slower of the two
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            chats_future = executor.submit(execute_chat_statement, 'chat_messages', client_id)
+            client_future = executor.submit(execute_chat_statement, 'chat_client', client_id)
+            chats = chats_future.result()
+            client_rows = client_future.result()
+        client_info = client_rows[0] if client_rows else None
+
+        chat_transcript = [
+            {"timestamp": timestamp, "role": role, "message": message}
+            for timestamp, role, message in chats
+        ]
 
         if client_info:
             client_name, client_id, assigned_employee_name = client_info
@@ -145,22 +179,12 @@ def fetch_chat_data(db_params, client_id):
             client_name = "Client"
             assigned_employee_name = "Sales Rep"
 
-        cur.close()
-        conn.close()
-
         return chat_transcript, client_name, assigned_employee_name
 
     except Exception as e:
         st.error(f"Error fetching chat data for client ID {client_id}: {e}")
         return [], None, None
 
-# Function to simulate a streaming response (sales rep)
-def response_generator(message):
-    response = f"Thank you for reaching out, {message}. I will get back to you soon."
-    for word in response.split():
-        yield word + " "
-        time.sleep(0.1)
-
 # Function to display chat UI with custom styling
 def display_chat_ui(chat_transcript, client_name, assigned_employee_name):
     # Inject CSS to make chat bubbles
@@ -222,44 +246,33 @@ def display_chat_ui(chat_transcript, client_name, assigned_employee_name):
             """, unsafe_allow_html=True)
 
     # Input box for new messages
-    # prompt = st.chat_input("Type your message...")
     st.write("This is a read-only chat view. Input is disabled.")
-    # prompt = None
-    # if prompt:
-    #     # Add new user message (client message) to chat history
-    #     st.session_state.messages.append({"role": "client", "content": prompt})
-    #     st.markdown(f"""
-    #     <div class="chat-box">
-    #         <div class="client-message">
-    #             <b>{client_name}</b> <span class="timestamp">(Just now)</span>
-    #             <p>{prompt}</p>
-    #         </div>
-    #     </div>
-    #     """, unsafe_allow_html=True)
-
-    #     # Display sales rep's simulated response (streaming)
-    #     with st.chat_message("sales_rep"):
-    #         for word in response_generator(prompt):
-    #             st.markdown(word, unsafe_allow_html=True)
-    #             st.experimental_rerun()  # To stream progressively
-
-    #     # Add sales rep's response to the session state
-    #     response = f"Thank you for reaching out, {prompt}. I will get back to you soon."
-    #     st.session_state.messages.append({"role": "sales_rep", "content": response})
 
 # Display the client data in Streamlit with clickable phone numbers and client links
 def display_clients(df, title):
     st.subheader(title)
-    
+
     if df.empty:
         st.write("No clients found matching the criteria.")
     else:
-        df['client_url'] = df['client_id'].apply(lambda x: f'<a href="/?client_id={x}">{x}</a>')
-
-        df.loc[:, 'phone_link'] = df['fphone1'].apply(lambda x: f'<a href="tel:{x}">{x}</a>' if pd.notnull(x) else '')
-        
-        html_table = df[['client_fullname', 'phone_link', 'client_url', 'assigned_employee_fullname', 'city', 'state', 'street']].to_html(escape=False, index=False)
-        st.markdown(html_table, unsafe_allow_html=True)
+        # Vectorized string concat instead of a Python lambda per row
+        ids = df['client_id'].astype(str)
+        df['client_url'] = '/?client_id=' + ids
+
+        mask = df['fphone1'].notna()
+        df.loc[:, 'phone_url'] = ''
+        df.loc[mask, 'phone_url'] = 'tel:' + df.loc[mask, 'fphone1'].astype(str)
+
+        # st.dataframe ships the table as Arrow and renders it virtualized,
+        # instead of building one big HTML string for st.markdown
+        st.dataframe(
+            df[['client_fullname', 'phone_url', 'client_url', 'assigned_employee_fullname', 'city', 'state', 'street']],
+            column_config={
+                'phone_url': st.column_config.LinkColumn('Phone', display_text=r'tel:(.+)'),
+                'client_url': st.column_config.LinkColumn('Client', display_text=r'client_id=(\d+)'),
+            },
+            hide_index=True,
+        )
 
 # Main function to run the app
 def main():
@@ -271,7 +284,7 @@ def main():
         # Show chat transcript for selected client_id
         try:
             client_id = int(client_id_str)
-            chat_transcript, client_name, assigned_employee_name = fetch_chat_data(db_params, client_id)
+            chat_transcript, client_name, assigned_employee_name = fetch_chat_data(client_id)
             st.title(f"Chat with {client_name}")
             st.markdown(f"Assigned Employee: {assigned_employee_name}")
 
@@ -283,14 +296,19 @@ def main():
             st.error("Invalid client ID.")
     else:
         # Show client data tables
-        df_stage_greater_than_4 = get_client_data_stage_greater_than_4()
-        df_stage_less_than_4 = get_client_data_stage_less_than_4()
-
-        df_processed_greater_than_4 = process_data(df_stage_greater_than_4)
-        df_processed_less_than_4 = process_data(df_stage_less_than_4)
-
-        display_clients(df_processed_greater_than_4, "Clients with Current Stage > 4 (Last 4 Days)")
-        display_clients(df_processed_less_than_4, "Clients with Current Stage < 4 (Last 4 Days)")
+        # Floor the current time to the minute so the cache key stays stable
+        # across reruns instead of changing on every call.
+        bucket = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        df_recent = get_client_data_recent(bucket)
+
+        # current_stage only drives the split; drop it before rendering
+        mask = df_recent['current_stage'] > 4
+        df_recent = df_recent.drop(columns=['current_stage'])
+        df_greater_than_4 = df_recent[mask]
+        df_less_than_4 = df_recent[~mask]
+
+        display_clients(df_greater_than_4, "Clients with Current Stage > 4 (Last 4 Days)")
+        display_clients(df_less_than_4, "Clients with Current Stage < 4 (Last 4 Days)")
 
 if __name__ == '__main__':
     main()